@@ -35,13 +35,21 @@
 #
 ############################################################################
 
+import functools
 import os
 import sys
 import logging
 import re
 
-is_not_set = re.compile(r'^# (?P<symbol>.*) is not set')
-is_config = re.compile(r'(?P<symbol>.*)=(?P<value>.*)')
+@functools.cache
+def _line_re():
+    # Compiled on first load() so importing this module for confirm()
+    # or make_savedefconfig() does not pay the compile cost.
+    # The set-option form comes first: it is by far the most common line
+    # in a defconfig, so most matches succeed on the first alternative.
+    return re.compile(r'^(?P<sym>CONFIG_[^=\n]+)=(?P<val>.*)$|'
+                      r'^# (?P<unset>CONFIG_\S+) is not set[ \t]*$',
+                      re.MULTILINE)
 
 DEFCONFIG_HEADER = '''#
 # This file is autogenerated: PLEASE DO NOT EDIT IT.
@@ -64,34 +72,39 @@ class Defconfig:
             return -1
 
         with open(path, 'r') as f:
-            for line in f:
-                m = is_not_set.match(line)
-                if m:
-                    sym = m.group('symbol').replace('CONFIG_', '', 1)
-                    self.opts[sym] = 'n'
-                else:
-                    m = is_config.match(line)
-                    if m:
-                        sym = m.group('symbol').replace('CONFIG_', '', 1)
-                        self.opts[sym] = m.group('value')
-                    else:
-                        logging.debug('[IGNORE]: %s' % line.strip())
+            text = f.read()
+
+        # Let the regex engine scan the whole file at once; lines which
+        # match neither alternative are skipped implicitly.
+        # Fill a fresh local dict and swap it in at the end; the options
+        # never touch the instance attribute while the loop runs.
+        opts = dict(self.opts)
+        for m in _line_re().finditer(text):
+            unset, sym, val = m.group('unset', 'sym', 'val')
+            if unset:
+                opts[unset] = 'n'
+            else:
+                opts[sym] = val
+        self.opts = opts
 
     def save(self, path=None):
         if path == None:
             path = self.path
 
-        # Save config as defconfig, for default defconfig
-        config = []
-        for (sym, val) in sorted(self.opts.items()):
-            if val == 'n':
-                config += ['# CONFIG_%s is not set' % sym]
-            else:
-                config += ['CONFIG_%s=%s' % (sym, val)]
+        # Save config as defconfig, for default defconfig.
+        # Output lines are ordered by symbol name, matching save_diff.
+        lines = ('# %s is not set' % sym if val == 'n' else
+                 '%s=%s' % (sym, val)
+                 for (sym, val) in sorted(self.opts.items()))
+
+        payload = DEFCONFIG_HEADER + '\n' + '\n'.join(lines) + '\n'
 
-        with open(path, 'w') as f:
-            print(DEFCONFIG_HEADER, file=f)
-            print('\n'.join(sorted(config)), file=f)
+        # Write to a temporary file and rename so a crash mid-write
+        # can not leave a truncated defconfig behind.
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(payload)
+        os.replace(tmp, path)
 
     def save_diff(self, target, path=None):
         '''
@@ -109,18 +122,27 @@ class Defconfig:
         changes = []
         minus = []
 
-        for (sym, val) in target.opts.items():
-            if sym not in self.opts:
-                minus.append('-%s=%s' % (sym, val))
-        for (sym, val) in self.opts.items():
-            if sym not in target.opts:
-                plus.append('+%s=%s' % (sym, val))
-            if sym in target.opts and target.opts[sym] != val:
-                changes.append(' %s=%s->%s' % (sym, target.opts[sym], val))
-
-        out = sorted(minus) + sorted(changes) + sorted(plus)
-        with open(path, 'w') as f:
-            print('\n'.join(out), file=f)
+        s = self.opts
+        t = target.opts
+        sentinel = object()
+        for sym in sorted(s.keys() | t.keys()):
+            sv = s.get(sym, sentinel)
+            tv = t.get(sym, sentinel)
+            # Diff defconfigs carry prefix-less symbols; config.py
+            # applies them against stripped keys, so drop CONFIG_ here.
+            if sv is sentinel:
+                minus.append('-%s=%s' % (sym[7:], tv))
+            elif tv is sentinel:
+                plus.append('+%s=%s' % (sym[7:], sv))
+            elif sv != tv:
+                changes.append(' %s=%s->%s' % (sym[7:], tv, sv))
+
+        # The buckets were filled in symbol order, so no further sorting.
+        out = minus + changes + plus
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(out) + '\n')
+        os.replace(tmp, path)
 
     def __repr__(self):
         r = []